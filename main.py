@@ -3,12 +3,18 @@ from playwright.sync_api import (
     TimeoutError as PlaywrightTimeoutError,
     Error as PlaywrightError,
 )
-from urllib.parse import urljoin
+from urllib.parse import urljoin, urlsplit
 import json
 import csv
 import os
 import re
 import random
+import time
+import heapq
+import math
+import html
+import hashlib
+from itertools import zip_longest
 
 # --- OCR engine (ddddocr) initialization and preprocessing helpers ---
 DDDDOCR_READER = None
@@ -25,19 +31,71 @@ def get_ddddocr_reader():
     return DDDDOCR_READER
 
 
-def preprocess_for_ocr(img_path: str):
+def preprocess_pil(img):
+    from PIL import Image, ImageOps, ImageFilter
+    img = ImageOps.grayscale(img)
+    img = ImageOps.autocontrast(img)
+    w, h = img.size
+    if max(w, h) < 120:
+        img = img.resize((w * 2, h * 2), Image.LANCZOS)
+    return img.filter(ImageFilter.UnsharpMask(radius=1, percent=150, threshold=3))
+
+
+def unsharp_mask_batch(
+    batch, radius: float = 1.0, percent: int = 150, threshold: int = 3
+):
+    # 对 (N, H, W) 灰度批次做可分离高斯模糊后的 UnsharpMask
+    import numpy as np
+    offsets = np.arange(-2, 3, dtype=np.float32)
+    kernel = np.exp(-0.5 * (offsets / radius) ** 2)
+    kernel /= kernel.sum()
+    _, h, w = batch.shape
+    padded = np.pad(batch, ((0, 0), (2, 2), (0, 0)), mode="edge")
+    blur = sum(k * padded[:, i : i + h, :] for i, k in enumerate(kernel))
+    padded = np.pad(blur, ((0, 0), (0, 0), (2, 2)), mode="edge")
+    blur = sum(k * padded[:, :, i : i + w] for i, k in enumerate(kernel))
+    diff = batch - blur
+    sharp = np.where(np.abs(diff) >= threshold, batch + diff * (percent / 100), batch)
+    return np.clip(np.rint(sharp), 0, 255).astype(np.uint8)
+
+
+def preprocess_batch(images: list) -> list:
+    # 批量预处理：同尺寸图片堆叠为 (N, H, W)，灰度、自动对比度与锐化按批向量化；
+    # 返回 L 模式 PIL 图片，直接交给 ddddocr，不再经过 PNG 编解码
     try:
-        from PIL import Image, ImageOps, ImageFilter
-        img = Image.open(img_path)
-        img = ImageOps.grayscale(img)
-        img = ImageOps.autocontrast(img)
-        w, h = img.size
-        if max(w, h) < 120:
-            img = img.resize((w * 2, h * 2), Image.LANCZOS)
-        img = img.filter(ImageFilter.UnsharpMask(radius=1, percent=150, threshold=3))
-        return img
+        import numpy as np
+        from PIL import Image
     except Exception:
-        return None
+        return [preprocess_pil(img) for img in images]
+    out = [None] * len(images)
+    groups = {}
+    for i, img in enumerate(images):
+        groups.setdefault(img.size, []).append(i)
+    luma = np.array([0.299, 0.587, 0.114], dtype=np.float32)
+    for (w, h), idxs in groups.items():
+        rgb = np.stack(
+            [np.asarray(images[i].convert("RGB"), dtype=np.float32) for i in idxs]
+        )
+        gray = np.rint(rgb @ luma)
+        lo = gray.min(axis=(1, 2), keepdims=True)
+        hi = gray.max(axis=(1, 2), keepdims=True)
+        span = np.maximum(hi - lo, 1)
+        gray = np.where(hi > lo, np.rint((gray - lo) * (255 / span)), gray)
+        if max(w, h) < 120:
+            gray = np.stack(
+                [
+                    np.asarray(
+                        Image.fromarray(g.astype(np.uint8)).resize(
+                            (w * 2, h * 2), Image.LANCZOS
+                        ),
+                        dtype=np.float32,
+                    )
+                    for g in gray
+                ]
+            )
+        for i, arr in zip(idxs, unsharp_mask_batch(gray)):
+            out[i] = Image.fromarray(arr)
+    return out
 
 # Normalize common OCR misreads in numeric text (letters mistaken for digits)
 DIGIT_MAP = str.maketrans({
@@ -58,8 +116,25 @@ def normalize_ocr_digits(s: str) -> str:
 # 电子烟:https://www.yanyue.cn/e
 
 BLOCKED_TYPES = {"image", "media", "font", "stylesheet"}
+# 常见统计/广告域名，非分析模式下始终阻断
+TRACKER_HOST_PATTERNS = (
+    "hm.baidu.com",
+    "pos.baidu.com",
+    "cpro.baidu.com",
+    "cbjs.baidu.com",
+    "google-analytics.com",
+    "googletagmanager.com",
+    "googlesyndication.com",
+    "doubleclick.net",
+    "cnzz.com",
+    "umeng.com",
+    "51.la",
+)
 CRAWL_DELAY_MS = int(os.getenv("YANYUE_DELAY_MS", "15000"))
 DELAY_JITTER_MS = int(os.getenv("YANYUE_DELAY_JITTER_MS", "5000"))
+BUDGET_SECONDS = int(os.getenv("YANYUE_BUDGET_SECONDS", "0") or 0)
+BUDGET_REQUESTS = int(os.getenv("YANYUE_BUDGET_REQUESTS", "0") or 0)
+STALE_DAYS = float(os.getenv("YANYUE_STALE_DAYS", "30") or 30)
 YANYUE_USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/128.0.0.0 Safari/537.36"
 # YANYUE_LIMIT_BRANDS = 2
 # YANYUE_LIMIT_PRODUCT_PAGES = 2
@@ -70,6 +145,39 @@ def ensure_dir(dir_path: str):
     os.makedirs(dir_path, exist_ok=True)
 
 
+# 运行预算：墙钟秒数与请求数（0 表示不限）
+BUDGET = {"started": time.monotonic(), "requests": 0}
+
+
+def budget_remaining_ms() -> int | None:
+    if not BUDGET_SECONDS:
+        return None
+    elapsed = time.monotonic() - BUDGET["started"]
+    return max(0, int((BUDGET_SECONDS - elapsed) * 1000))
+
+
+def budget_exhausted() -> bool:
+    if BUDGET_SECONDS and time.monotonic() - BUDGET["started"] >= BUDGET_SECONDS:
+        return True
+    if BUDGET_REQUESTS and BUDGET["requests"] >= BUDGET_REQUESTS:
+        return True
+    return False
+
+
+# 共享速率预算：所有分区共用同一节流时钟，距上次请求不足 Crawl-delay(+抖动) 时补足等待
+LAST_REQUEST_AT = 0.0
+
+
+def wait_for_rate_budget(page):
+    global LAST_REQUEST_AT
+    BUDGET["requests"] += 1
+    gap_ms = CRAWL_DELAY_MS + random.randint(0, DELAY_JITTER_MS)
+    elapsed_ms = (time.monotonic() - LAST_REQUEST_AT) * 1000
+    if elapsed_ms < gap_ms:
+        page.wait_for_timeout(int(gap_ms - elapsed_ms))
+    LAST_REQUEST_AT = time.monotonic()
+
+
 # 公共：收集可见链接并按规则过滤，写入 results（去重）
 # 站点地址常量（替换原注释为变量）
 BASE_URL = "https://www.yanyue.cn"
@@ -77,6 +185,28 @@ TOBACCO_URL = f"{BASE_URL}/tobacco"
 HNB_URL = f"{BASE_URL}/hnb"
 E_URL = f"{BASE_URL}/e"
 ASHIMA_URL = f"{BASE_URL}/sort/14"
+PRODUCT_INDEX_PATH = os.getenv("YANYUE_PRODUCT_INDEX", "yanyue_products_index.ndjson")
+RETRY_QUEUE_PATH = os.getenv("YANYUE_RETRY_QUEUE", "yanyue_retry_queue.json")
+RETRY_BASE_MS = int(os.getenv("YANYUE_RETRY_BASE_MS", "60000"))
+RETRY_MAX_ATTEMPTS = int(os.getenv("YANYUE_RETRY_MAX_ATTEMPTS", "5"))
+BREAKER_THRESHOLD = int(os.getenv("YANYUE_BREAKER_THRESHOLD", "5"))
+BREAKER_PAUSE_MS = int(os.getenv("YANYUE_BREAKER_PAUSE_MS", "600000"))
+DISCOVERY_PATH = os.getenv("YANYUE_DISCOVERY", "yanyue_discovery.json")
+PROBE_RANGE = os.getenv("YANYUE_PROBE_RANGE", "")
+PROBE_LIMIT = int(os.getenv("YANYUE_PROBE_LIMIT", "200") or 200)
+GENPIC_STORE_DIR = os.getenv("YANYUE_GENPIC_STORE", "yanyue_genpic")
+GENPIC_INDEX_PATH = os.path.join(GENPIC_STORE_DIR, "index.ndjson")
+RECYCLE_NAVIGATIONS = int(os.getenv("YANYUE_RECYCLE_NAVIGATIONS", "200") or 200)
+RECYCLE_RSS_MB = int(os.getenv("YANYUE_RECYCLE_RSS_MB", "1500") or 1500)
+RECYCLE_HEAP_MB = int(os.getenv("YANYUE_RECYCLE_HEAP_MB", "256") or 256)
+RECYCLE_LATENCY_FACTOR = float(os.getenv("YANYUE_RECYCLE_LATENCY_FACTOR", "2") or 2)
+RECYCLE_COOLDOWN = int(os.getenv("YANYUE_RECYCLE_COOLDOWN", "20") or 20)
+LATENCY_WINDOW = 20
+PROFILE_REQUESTS = os.getenv("YANYUE_PROFILE_REQUESTS", "") not in ("", "0")
+REQUEST_RULES_PATH = os.getenv("YANYUE_REQUEST_RULES", "yanyue_request_rules.json")
+# 分析模式下同一请求试探多少次未出现后不再选它（如按产品变化的 XHR 路径）
+PROBE_MAX_MISSES = 3
+VERIFY_LISTINGS = os.getenv("YANYUE_VERIFY_LISTINGS", "") not in ("", "0")
 
 
 def collect_anchors(
@@ -278,8 +408,72 @@ def append_csv_row(file_path: str, headers: tuple, row_dict: dict):
         writer.writerow([row_dict.get(h, "") for h in headers])
 
 
-def load_ndjson_hrefs(path: str) -> set:
-    hrefs = set()
+def product_id_from_href(href: str) -> str:
+    m = re.search(r"/product/(\d+)", href or "")
+    return m.group(1) if m else ""
+
+
+# 全局产品索引：按 /product/<id> 去重，跨品牌/标签复用已抓取的详情
+# 索引只记录 id -> 所属品牌目录/href/抓取时间，详情以所属品牌的详情流为准
+def load_product_index(path: str) -> dict:
+    index = {}
+    if os.path.exists(path):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        obj = json.loads(line.strip())
+                    except Exception:
+                        continue
+                    pid = obj.get("id")
+                    if pid:
+                        index[pid] = product_index_entry(
+                            pid,
+                            obj.get("owner", ""),
+                            obj.get("href", ""),
+                            obj.get("scraped_at")
+                            or (obj.get("details") or {}).get("scraped_at"),
+                        )
+        except Exception:
+            pass
+    return index
+
+
+def product_index_entry(pid: str, owner: str, href: str, scraped_at) -> dict:
+    return {"id": pid, "href": href, "owner": owner, "scraped_at": scraped_at}
+
+
+def compact_product_index(path: str, index: dict):
+    # 重复抓取与旧格式（内嵌完整详情）的行在启动时合并为每个产品一行
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            lines = f.readlines()
+    except OSError:
+        return
+    if len(lines) <= len(index) and not any('"details"' in line for line in lines):
+        return
+    tmp = path + ".tmp"
+    try:
+        with open(tmp, "w", encoding="utf-8") as f:
+            for entry in index.values():
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        os.replace(tmp, path)
+        print(f"[index] 压缩全局产品索引: {len(lines)} 行 -> {len(index)} 行")
+    except OSError:
+        pass
+
+
+def index_product(index: dict, path: str, pid: str, owner: str, details: dict):
+    entry = product_index_entry(
+        pid, owner, details.get("href", ""), details.get("scraped_at")
+    )
+    index[pid] = entry
+    append_ndjson(path, entry)
+
+
+def load_ndjson_records(path: str) -> dict:
+    # 按 href 读取详情流，同一 href 以最后一行（最近一次抓取）为准
+    records = {}
     if os.path.exists(path):
         try:
             with open(path, "r", encoding="utf-8") as f:
@@ -288,81 +482,248 @@ def load_ndjson_hrefs(path: str) -> set:
                         obj = json.loads(line.strip())
                         href = obj.get("href")
                         if href:
-                            hrefs.add(href)
+                            records[href] = obj
                     except Exception:
                         continue
         except Exception:
             pass
-    return hrefs
+    return records
+
+
+# 需要按数字清洗的 genpic 字段
+OCR_NUMERIC_KEYS = {
+    "tar",
+    "nicotine",
+    "co",
+    "length",
+    "filter_length",
+    "circumference",
+    "per_pack_count",
+    "packs_per_carton",
+    "pack_price",
+    "carton_price",
+    "pack_barcode",
+    "条装条码",
+}
+
+
+def clean_ocr_text(key: str, raw: str) -> str:
+    # Field-specific normalization: keep expected characters
+    raw = normalize_ocr_digits(raw.replace("￥", "¥"))
+    if key in {"pack_price", "carton_price"}:
+        return re.sub(r"[^0-9.¥]", "", raw)
+    if key in {"pack_barcode", "条装条码"}:
+        return re.sub(r"[^0-9]", "", raw)
+    if key in OCR_NUMERIC_KEYS:
+        text = re.sub(r"[^0-9.]", "", raw)
+        # normalize decimals like '.5' -> '0.5' and '1.' -> '1'
+        if text.startswith(".") and text[1:].isdigit():
+            text = "0" + text
+        if text.endswith(".") and text[:-1].isdigit():
+            text = text[:-1]
+        return text
+    return raw
+
+
+def ocr_raw_batch(reader, blobs: list) -> list:
+    # 一次解码一组图片并批量预处理；预处理失败时退回原始字节
+    from io import BytesIO
+    inputs = list(blobs)
+    try:
+        from PIL import Image
+        images = []
+        for b in blobs:
+            img = Image.open(BytesIO(b))
+            img.load()
+            images.append(img)
+        inputs = preprocess_batch(images)
+    except Exception:
+        pass
+    results = []
+    for x in inputs:
+        # Use classification for single-line OCR
+        try:
+            results.append(reader.classification(x))
+        except Exception:
+            results.append("")
+    return results
+
 
+# genpic 内容寻址存储：按 SHA-1 只保存一次，索引记录 (href, field, idx) -> sha1 与原始识别结果
+GENPIC_RAW_CACHE = None
+# (href, field, idx) -> 索引中最近一次记录的 sha1，映射未变时不再追加索引行
+GENPIC_MAPPING = {}
 
-def ocr_genpic(
-    img_locator, save_dir: str | None, filename_prefix: str, idx: int
-) -> dict:
-    path = ""
-    src = ""
+
+def genpic_store_path(digest: str) -> str:
+    return os.path.join(GENPIC_STORE_DIR, digest[:2], f"{digest}.png")
+
+
+def get_genpic_raw_cache() -> dict:
+    global GENPIC_RAW_CACHE
+    if GENPIC_RAW_CACHE is None:
+        GENPIC_RAW_CACHE = {}
+        if os.path.exists(GENPIC_INDEX_PATH):
+            try:
+                with open(GENPIC_INDEX_PATH, "r", encoding="utf-8") as f:
+                    for line in f:
+                        try:
+                            obj = json.loads(line.strip())
+                        except Exception:
+                            continue
+                        if not obj.get("sha1"):
+                            continue
+                        key = obj.get("field")
+                        idx = int(obj.get("idx") or 0)
+                        GENPIC_MAPPING[(obj.get("href"), key, idx)] = obj["sha1"]
+                        # 未识别出内容的记录不缓存，下次抓取重新识别
+                        if obj.get("raw"):
+                            GENPIC_RAW_CACHE[obj["sha1"]] = obj["raw"]
+            except Exception:
+                pass
+    return GENPIC_RAW_CACHE
+
+
+def wait_for_genpics(page, timeout_ms: int = 10000):
+    # 详情页在 #product_detail 出现后立即解析，genpic 图片可能仍在加载；
+    # 截图前等待全部加载完成，避免把空白或半张图片写入存储并缓存其识别结果
     try:
-        src = img_locator.get_attribute("src") or ""
+        page.wait_for_function(
+            """() => Array.from(document.querySelectorAll('#product_detail img.genpic'))
+                .every(img => img.complete && img.naturalWidth > 0)""",
+            timeout=timeout_ms,
+        )
+    except PlaywrightTimeoutError:
+        print(f"[genpic] 图片未在 {timeout_ms}ms 内加载完成，跳过未加载的图片")
+    except PlaywrightError:
+        pass
+
+
+def capture_genpic(img_locator) -> dict | None:
+    # 截取 genpic 图片并写入内容寻址存储（已存在则跳过）；未加载完成的图片不截取
+    try:
+        if not img_locator.evaluate("img => img.complete && img.naturalWidth > 0"):
+            return None
+        png = img_locator.screenshot()
     except PlaywrightError:
-        src = ""
-    if save_dir:
-        os.makedirs(save_dir, exist_ok=True)
+        return None
+    if not png:
+        return None
+    digest = hashlib.sha1(png).hexdigest()
+    path = genpic_store_path(digest)
+    if not os.path.exists(path):
+        ensure_dir(os.path.dirname(path))
+        with open(path, "wb") as f:
+            f.write(png)
+    return {"png": png, "sha1": digest, "path": path}
+
+
+def ocr_genpic_batch(shots: list, href: str) -> dict:
+    # shots: [(key, idx, capture_genpic 结果)]，返回 key -> 拼接后的识别值
+    # 相同图片只识别一次（同页、跨产品、跨运行复用原始识别结果），其余整批预处理
+    cache = get_genpic_raw_cache()
+    todo = {}
+    for _, _, shot in shots:
+        if shot["sha1"] not in cache:
+            todo.setdefault(shot["sha1"], shot["png"])
+    recognized = set()
+    if todo:
         try:
-            path = os.path.join(save_dir, f"{filename_prefix}_{idx}.png")
-            img_locator.screenshot(path=path)
-        except PlaywrightError:
-            path = ""
-    text = ""
+            reader = get_ddddocr_reader()
+            if reader:
+                raws = ocr_raw_batch(reader, list(todo.values()))
+                for digest, raw in zip(todo.keys(), raws):
+                    if raw:
+                        cache[digest] = raw
+                        recognized.add(digest)
+        except Exception:
+            pass
+    values = {}
+    for key, idx, shot in shots:
+        raw = cache.get(shot["sha1"], "")
+        # 映射未变且没有新的识别结果需要持久化时不追加，索引随唯一图片而非抓取次数增长
+        mapping_key = (href, key, idx)
+        if (
+            GENPIC_MAPPING.get(mapping_key) != shot["sha1"]
+            or shot["sha1"] in recognized
+        ):
+            entry = {"href": href, "field": key, "idx": idx, "sha1": shot["sha1"]}
+            # 仅记录实际识别出的结果；无 OCR 或识别失败时留给后续运行 / ocr_test.py 补识别
+            if raw:
+                entry["raw"] = raw
+            append_ndjson(GENPIC_INDEX_PATH, entry)
+            GENPIC_MAPPING[mapping_key] = shot["sha1"]
+            recognized.discard(shot["sha1"])
+        text = clean_ocr_text(key, raw)
+        if text:
+            values[key] = values.get(key, "") + text
+    return values
+
+
+# 熔断器：连续导航失败达到阈值视为站点限流，暂停整个抓取后再半开重试
+BREAKER = {"failures": 0, "trips": 0}
+
+
+def record_navigation(page, ok: bool):
+    if ok:
+        BREAKER["failures"] = 0
+        BREAKER["trips"] = 0
+        return
+    BREAKER["failures"] += 1
+    if BREAKER["failures"] < BREAKER_THRESHOLD:
+        return
+    pause_ms = min(BREAKER_PAUSE_MS * (2 ** BREAKER["trips"]), BREAKER_PAUSE_MS * 8)
+    # 暂停不得超出剩余运行预算，避免 CI 作业在提交输出前超时
+    remaining_ms = budget_remaining_ms()
+    if remaining_ms is not None:
+        pause_ms = min(pause_ms, remaining_ms)
+    print(
+        f"[breaker] 连续导航失败 {BREAKER['failures']} 次，疑似被限流，暂停 {pause_ms // 1000}s"
+    )
+    page.wait_for_timeout(pause_ms)
+    BREAKER["trips"] += 1
+    BREAKER["failures"] = 0
+
+
+# 持久化重试队列：失败 URL 按指数退避延后重试，不阻塞后续正常 URL
+def load_retry_queue(path: str) -> list:
+    return load_json_if_exists(path)
+
+
+def save_retry_queue(path: str, queue: list):
     try:
-        reader = get_ddddocr_reader()
-        if reader and path:
-            from io import BytesIO
-            img = preprocess_for_ocr(path)
-            if img is not None:
-                buf = BytesIO()
-                img.save(buf, format="PNG")
-                img_bytes = buf.getvalue()
-            else:
-                with open(path, "rb") as f:
-                    img_bytes = f.read()
-            # Use classification for single-line OCR
-            try:
-                raw = reader.classification(img_bytes)
-            except Exception:
-                raw = ""
-            raw = raw.replace("￥", "¥")
-            raw = normalize_ocr_digits(raw)
-            # Field-specific normalization: keep expected characters
-            numeric_keys = {
-                "tar",
-                "nicotine",
-                "co",
-                "length",
-                "filter_length",
-                "circumference",
-                "per_pack_count",
-                "packs_per_carton",
-                "pack_price",
-                "carton_price",
-                "pack_barcode",
-                "条装条码",
-            }
-            if filename_prefix in {"pack_price", "carton_price"}:
-                text = re.sub(r"[^0-9.¥]", "", raw)
-            elif filename_prefix in {"pack_barcode", "条装条码"}:
-                text = re.sub(r"[^0-9]", "", raw)
-            elif filename_prefix in numeric_keys:
-                text = re.sub(r"[^0-9.]", "", raw)
-                # normalize decimals like '.5' -> '0.5' and '1.' -> '1'
-                if text.startswith(".") and text[1:].isdigit():
-                    text = "0" + text
-                if text.endswith(".") and text[:-1].isdigit():
-                    text = text[:-1]
-            else:
-                text = raw
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(queue, f, ensure_ascii=False, indent=2)
     except Exception:
-        text = ""
-    return {"text": text, "path": path, "src": src}
+        pass
+
+
+def enqueue_retry(queue: list, entry: dict):
+    queue[:] = [e for e in queue if e.get("url") != entry.get("url")]
+    attempts = int(entry.get("attempts", 0)) + 1
+    if attempts > RETRY_MAX_ATTEMPTS:
+        print(f"[retry] 超过最大重试次数，放弃: {entry.get('url')}")
+    else:
+        entry["attempts"] = attempts
+        entry["next_at"] = time.time() + RETRY_BASE_MS * (2 ** (attempts - 1)) / 1000
+        queue.append(entry)
+        print(
+            f"[retry] 加入重试队列 (第 {attempts} 次): {entry.get('url')}"
+        )
+    save_retry_queue(RETRY_QUEUE_PATH, queue)
+
+
+def take_due_retries(queue: list, until: float, brand_key: str | None = None) -> list:
+    due = [
+        e
+        for e in queue
+        if e.get("next_at", 0) <= until
+        and (brand_key is None or e.get("brand_key") == brand_key)
+    ]
+    if due:
+        queue[:] = [e for e in queue if e not in due]
+        save_retry_queue(RETRY_QUEUE_PATH, queue)
+    return sorted(due, key=lambda e: e.get("next_at", 0))
 
 
 def navigate_and_wait(
@@ -375,6 +736,9 @@ def navigate_and_wait(
     last_err = None
     for attempt in range(retries + 1):
         try:
+            wait_for_rate_budget(page)
+            page_class = begin_page(content_selector)
+            started = time.monotonic()
             page.goto(url, wait_until="domcontentloaded", timeout=timeout_ms)
             try:
                 page.wait_for_selector("text=内容加载中", timeout=2000)
@@ -385,29 +749,46 @@ def navigate_and_wait(
                 try:
                     page.wait_for_selector(content_selector, timeout=10000)
                 except PlaywrightTimeoutError:
-                    pass
-            # 遵守 Crawl-delay + 随机抖动，降低被动防
-            page.wait_for_timeout(CRAWL_DELAY_MS + random.randint(0, DELAY_JITTER_MS))
+                    if content_missing(page_class):
+                        # 试探阻断的请求是必需的：不再阻断，重新加载一次
+                        wait_for_rate_budget(page)
+                        page.goto(url, wait_until="domcontentloaded", timeout=timeout_ms)
+                        try:
+                            page.wait_for_selector(content_selector, timeout=10000)
+                        except PlaywrightTimeoutError:
+                            pass
+            elapsed_ms = (time.monotonic() - started) * 1000
+            end_page(page_class, elapsed_ms)
+            record_navigation(page, True)
+            record_latency(elapsed_ms)
             return True
         except (PlaywrightTimeoutError, PlaywrightError) as e:
             last_err = e
-            # 渐进退避 + 抖动
-            backoff = 1000 * (attempt + 1)
-            page.wait_for_timeout(backoff + random.randint(0, DELAY_JITTER_MS))
+            if attempt < retries:
+                # 渐进退避 + 抖动
+                backoff = 1000 * (attempt + 1)
+                page.wait_for_timeout(backoff + random.randint(0, DELAY_JITTER_MS))
+    record_navigation(page, False)
     return False
 
 
-def scrape_brand_products(page, brand_url: str, max_pages: int = 100):
+def scrape_brand_products(
+    page,
+    brand_url: str,
+    max_pages: int = 100,
+    listing_selector: str = "#left #prowrap",
+    product_prefix: str = "/product/",
+):
     results = []
     seen = set()
 
     def collect_current_page():
         collect_anchors(
             page,
-            "#left #prowrap a[href]",
+            f"{listing_selector} a[href]",
             results,
             seen,
-            href_prefix="/product/",
+            href_prefix=product_prefix,
             exclude_names=["更多信息", "评论"],
             extra_fields=None,
         )
@@ -428,10 +809,10 @@ def scrape_brand_products(page, brand_url: str, max_pages: int = 100):
                 if loc.count() > 0:
                     next_a = loc.first
                     if next_a.is_visible():
+                        # 分页导航同样计入共享速率预算
+                        wait_for_rate_budget(page)
                         next_a.click(timeout=5000)
                         page.wait_for_load_state("domcontentloaded")
-                        # 分页导航后等待 Crawl-delay + 随机抖动
-                        page.wait_for_timeout(CRAWL_DELAY_MS + random.randint(0, DELAY_JITTER_MS))
                         return True
             except PlaywrightError:
                 continue
@@ -439,7 +820,7 @@ def scrape_brand_products(page, brand_url: str, max_pages: int = 100):
 
     # 仅在当前不在目标品牌页时才导航，避免重复等待
     if page.url != brand_url:
-        navigate_and_wait(page, brand_url, content_selector="#prowrap", retries=1)
+        navigate_and_wait(page, brand_url, content_selector=listing_selector, retries=1)
 
     for _ in range(max_pages):
         collect_current_page()
@@ -449,7 +830,7 @@ def scrape_brand_products(page, brand_url: str, max_pages: int = 100):
     return results
 
 
-def scrape_product_detail(page, img_save_dir: str | None = None) -> dict:
+def scrape_product_detail(page) -> dict:
     details = {
         "name": "",
         "href": page.url,
@@ -511,10 +892,12 @@ def scrape_product_detail(page, img_save_dir: str | None = None) -> dict:
 
         # 解析 ul.ul_1 属性对（支持 genpic 图片数字）
         try:
+            wait_for_genpics(page)
             ul = page.locator("#product_detail ul.ul_1")
             if ul.count() > 0:
                 lis = ul.locator("li")
                 lc = lis.count()
+                genpics = []
                 title_map = {
                     "品牌": "brand",
                     "类型": "type",
@@ -544,27 +927,17 @@ def scrape_product_detail(page, img_save_dir: str | None = None) -> dict:
                             if i + 1 < lc:
                                 content_li = lis.nth(i + 1)
                                 val_text = (content_li.inner_text() or "").strip()
+                                details[key] = val_text
+                                # genpic 先统一截图，整页收集完毕后批量识别
                                 imgs = content_li.locator("img.genpic")
-                                ocr_val = ""
-                                if imgs.count() > 0:
-                                    parts = []
-                                    save_dir = (
-                                        os.path.join(img_save_dir or "", "genpic")
-                                        if img_save_dir
-                                        else None
-                                    )
-                                    for j in range(imgs.count()):
-                                        r = ocr_genpic(
-                                            imgs.nth(j), save_dir, f"{key}", j + 1
-                                        )
-                                        if r.get("text"):
-                                            parts.append(r["text"])
-                                    if parts:
-                                        ocr_val = "".join(parts)
-                                value = ocr_val or val_text
-                                details[key] = value
+                                for j in range(imgs.count()):
+                                    shot = capture_genpic(imgs.nth(j))
+                                    if shot:
+                                        genpics.append((key, j + 1, shot))
                     except PlaywrightError:
                         continue
+                for key, value in ocr_genpic_batch(genpics, details["href"]).items():
+                    details[key] = value
         except PlaywrightError:
             pass
 
@@ -590,238 +963,1053 @@ Object.defineProperty(navigator, 'plugins', { get: () => [1, 2, 3] });
         pass
 
 
-def main():
-    targets = [
-        {
-            "name": "tobacco",
-            "url": TOBACCO_URL,
-            "output_dir": "yanyue_tobacco_output",
-            "scraper": scrape_tobacco_brands,
-            "headers": ("name", "href", "tab"),
-        },
-        {
-            "name": "hnb",
-            "url": HNB_URL,
-            "output_dir": "yanyue_hnb_output",
-            "scraper": scrape_hnb,
-            "headers": ("name", "href", "section"),
-        },
-        {
-            "name": "e",
-            "url": E_URL,
-            "output_dir": "yanyue_e_output",
-            "scraper": scrape_e,
-            "headers": ("name", "href", "section"),
-        },
+# 请求阻断规则：分析模式下逐个试探内容出现前的请求——每次页面加载阻断一个候选请求，
+# 内容仍然出现则判定为可阻断，未出现则判定为必需并不阻断重新加载；
+# 运行时只阻断已验证可阻断的请求，未见过或未试探的请求一律放行
+NET = {
+    "page_class": "brands",
+    "content_ready": True,
+    "seen": {},
+    "stats": {},
+    "verdicts": {},
+    "misses": {},
+    "probe": None,
+    "probe_hit": False,
+    "blocklist": {},
+    "baseline": {},
+}
+
+
+def request_key(rt: str, url: str) -> str:
+    parts = urlsplit(url)
+    return f"{rt} {parts.netloc}{parts.path}"
+
+
+def request_key_host(key: str) -> str:
+    return key.split(" ", 1)[1].split("/", 1)[0]
+
+
+def is_tracker(host: str) -> bool:
+    return any(p in host for p in TRACKER_HOST_PATTERNS)
+
+
+def load_request_rules():
+    data = load_json_if_exists(REQUEST_RULES_PATH)
+    if not data:
+        return
+    verdicts = {}
+    for page_class, rules in (data.get("classes") or {}).items():
+        if not isinstance(rules, dict):
+            continue
+        v = verdicts.setdefault(page_class, {})
+        v.update({k: "needed" for k in rules.get("needed", [])})
+        v.update({k: "blockable" for k in rules.get("blockable", [])})
+        if PROFILE_REQUESTS:
+            # 上次未试探完的候选请求继续参与试探
+            seen = NET["seen"].setdefault(page_class, {})
+            for k in rules.get("untested", []):
+                seen.setdefault(k, 0)
+    if PROFILE_REQUESTS:
+        NET["verdicts"] = verdicts
+        print(f"[net] 继续试探请求规则: {REQUEST_RULES_PATH}")
+        return
+    NET["blocklist"] = {
+        c: {k for k, v in rules.items() if v == "blockable"}
+        for c, rules in verdicts.items()
+    }
+    NET["baseline"] = data.get("baseline", {})
+    print(f"[net] 使用请求阻断规则: {REQUEST_RULES_PATH}")
+
+
+def page_stats(page_class: str) -> dict:
+    return NET["stats"].setdefault(
+        page_class, {"pages": 0, "requests": 0, "aborted": 0, "bytes": 0, "ms": 0.0}
+    )
+
+
+def pick_probe(page_class: str) -> str | None:
+    # 选出现次数最多、尚未判定的候选请求；多次试探都未出现的不再选
+    verdicts = NET["verdicts"].get(page_class, {})
+    misses = NET["misses"].get(page_class, {})
+    candidates = [
+        (count, k)
+        for k, count in NET["seen"].get(page_class, {}).items()
+        if k not in verdicts
+        and misses.get(k, 0) < PROBE_MAX_MISSES
+        and not is_tracker(request_key_host(k))
     ]
+    return max(candidates)[1] if candidates else None
 
-    with sync_playwright() as p:
-        # 使用常量 UA 与 Crawl-delay 配置
-        chosen_ua = os.getenv("YANYUE_USER_AGENT", YANYUE_USER_AGENT)
-        # 使用环境可覆盖的 Crawl-delay 与随机抖动
 
-        browser = p.chromium.launch(headless=True)
-        context = browser.new_context(
-            user_agent=chosen_ua,
-            viewport={"width": 1280, "height": 800},
-            locale="zh-CN",
-            timezone_id="Asia/Shanghai",
+def begin_page(content_selector: str | None) -> str:
+    if not content_selector:
+        page_class = "brands"
+    elif content_selector == "#product_detail":
+        page_class = "detail"
+    else:
+        page_class = "listing"
+    NET["page_class"] = page_class
+    NET["content_ready"] = False
+    NET["probe_hit"] = False
+    NET["probe"] = None
+    # 只有能确认内容是否出现的页面类型才参与试探
+    if PROFILE_REQUESTS and content_selector:
+        NET["probe"] = pick_probe(page_class)
+    return page_class
+
+
+def end_page(page_class: str, elapsed_ms: float):
+    NET["content_ready"] = True
+    probe = NET["probe"]
+    if probe:
+        if NET["probe_hit"]:
+            # 阻断该请求后内容仍然出现：可阻断
+            NET["verdicts"].setdefault(page_class, {})[probe] = "blockable"
+        else:
+            misses = NET["misses"].setdefault(page_class, {})
+            misses[probe] = misses.get(probe, 0) + 1
+        NET["probe"] = None
+    stats = page_stats(page_class)
+    stats["pages"] += 1
+    stats["ms"] += elapsed_ms
+
+
+def content_missing(page_class: str) -> bool:
+    # 返回 True 表示内容缺失由分析模式的试探阻断造成，调用方应不阻断重新加载
+    probe = NET["probe"]
+    if probe and NET["probe_hit"]:
+        NET["verdicts"].setdefault(page_class, {})[probe] = "needed"
+        NET["probe"] = None
+        print(f"[net] {page_class} 页面依赖请求: {probe}")
+        return True
+    # 阻断规则可能已过时：该页面类型退回全部放行
+    if NET["blocklist"].pop(page_class, None):
+        print(f"[net] {page_class} 页面内容未出现，停用该类型的请求阻断规则")
+    return False
+
+
+def on_request_finished(request):
+    # 按实际传输字节计数（分块/压缩响应没有 content-length），取不到时退回响应头
+    try:
+        sizes = request.sizes()
+        size = sizes["responseHeadersSize"] + max(sizes["responseBodySize"], 0)
+    except (PlaywrightError, KeyError):
+        try:
+            response = request.response()
+            headers = response.headers if response else {}
+            size = int(headers.get("content-length") or 0)
+        except (PlaywrightError, ValueError):
+            size = 0
+    stats = page_stats(NET["page_class"])
+    stats["requests"] += 1
+    stats["bytes"] += size
+
+
+def is_main_document(request) -> bool:
+    # 只豁免主框架导航；广告 iframe（如 pos.baidu.com）的文档仍按跟踪域名阻断
+    return request.resource_type == "document" and request.frame.parent_frame is None
+
+
+def route_handler(route, request):
+    try:
+        rt = request.resource_type
+        url = request.url or ""
+        # 放行 genpic 反爬数字图片，其它图片仍阻断
+        if rt == "image":
+            if "genpic" in url:
+                route.continue_()
+            else:
+                route.abort()
+            return
+        if rt in BLOCKED_TYPES and not (rt == "stylesheet"):
+            route.abort()
+            return
+        # 阻断规则只在导航到内容出现之间试探，也只在同一窗口内生效；
+        # 标签页切换、翻页点击等内容出现后的请求不受规则约束（统计域名除外）
+        page_class = NET["page_class"]
+        key = request_key(rt, url)
+        if PROFILE_REQUESTS:
+            if not NET["content_ready"]:
+                if key == NET["probe"] and not is_main_document(request):
+                    NET["probe_hit"] = True
+                    page_stats(page_class)["aborted"] += 1
+                    route.abort()
+                    return
+                if not is_main_document(request):
+                    seen = NET["seen"].setdefault(page_class, {})
+                    seen[key] = seen.get(key, 0) + 1
+        elif not is_main_document(request) and (
+            is_tracker(urlsplit(url).netloc)
+            or (
+                not NET["content_ready"]
+                and key in NET["blocklist"].get(page_class, ())
+            )
+        ):
+            page_stats(page_class)["aborted"] += 1
+            route.abort()
+            return
+        route.continue_()
+    except PlaywrightError:
+        route.continue_()
+
+
+def summarize_page_stats() -> dict:
+    summary = {}
+    for page_class, s in NET["stats"].items():
+        pages = max(s["pages"], 1)
+        summary[page_class] = {
+            "pages": s["pages"],
+            "requests_per_page": round(s["requests"] / pages, 1),
+            "aborted_per_page": round(s["aborted"] / pages, 1),
+            "kb_per_page": round(s["bytes"] / pages / 1024, 1),
+            "ms_to_content": round(s["ms"] / pages),
+        }
+    return summary
+
+
+def report_requests():
+    summary = summarize_page_stats()
+    for page_class, cur in summary.items():
+        base = NET["baseline"].get(page_class)
+        line = (
+            f"[net] {page_class}: {cur['pages']} 页，"
+            f"每页 {cur['requests_per_page']} 个请求（阻断 {cur['aborted_per_page']}），"
+            f"{cur['kb_per_page']}KB，内容就绪 {cur['ms_to_content']}ms"
         )
-        page = context.new_page()
-        apply_stealth(page)
-        page.set_default_timeout(60000)
+        if base:
+            line += f"；分析基线 {base['kb_per_page']}KB，{base['ms_to_content']}ms"
+        print(line)
+    if PROFILE_REQUESTS:
+        # 按试探结果输出：必需 / 可阻断 / 尚未试探（下次分析运行继续）
+        classes = {}
+        for page_class in set(NET["seen"]) | set(NET["verdicts"]):
+            verdicts = NET["verdicts"].get(page_class, {})
+            seen = NET["seen"].get(page_class, {})
+            classes[page_class] = {
+                "needed": sorted(k for k, v in verdicts.items() if v == "needed"),
+                "blockable": sorted(k for k, v in verdicts.items() if v == "blockable"),
+                "untested": sorted(
+                    k
+                    for k in seen
+                    if k not in verdicts and not is_tracker(request_key_host(k))
+                ),
+            }
+            print(
+                f"[net] {page_class}: 必需 {len(classes[page_class]['needed'])}，"
+                f"可阻断 {len(classes[page_class]['blockable'])}，"
+                f"未试探 {len(classes[page_class]['untested'])}"
+            )
+        try:
+            with open(REQUEST_RULES_PATH, "w", encoding="utf-8") as f:
+                json.dump(
+                    {"classes": classes, "baseline": summary},
+                    f,
+                    ensure_ascii=False,
+                    indent=2,
+                )
+            print(f"[net] 已生成请求阻断规则: {REQUEST_RULES_PATH}")
+        except Exception:
+            pass
+
 
-        # 统一允许样式，其它非文本资源继续阻断
+def new_browser_context(browser, user_agent: str):
+    return browser.new_context(
+        user_agent=user_agent,
+        viewport={"width": 1280, "height": 800},
+        locale="zh-CN",
+        timezone_id="Asia/Shanghai",
+    )
+
+
+def open_page(context):
+    # 新页面统一应用 stealth、默认超时与资源路由（回收后重建时同样适用）
+    page = context.new_page()
+    apply_stealth(page)
+    page.set_default_timeout(60000)
+    # 统一允许样式，其它非文本资源继续阻断
+    page.route("**/*", route_handler)
+    page.on("requestfinished", on_request_finished)
+    return page
+
+
+# 看门狗：按导航次数、渲染器堆、进程 RSS 与导航延迟漂移回收页面/上下文
+WATCHDOG = {
+    "navigations": 0,
+    "latencies": [],
+    "baseline_ms": 0.0,
+    "page_recycles": 0,
+    "context_recycles": 0,
+    "rss_floor_mb": 0.0,
+}
+
+
+def record_latency(ms: float):
+    WATCHDOG["navigations"] += 1
+    latencies = WATCHDOG["latencies"]
+    latencies.append(ms)
+    del latencies[:-LATENCY_WINDOW]
+    # 回收后的前一个窗口作为延迟基线
+    if not WATCHDOG["baseline_ms"] and len(latencies) == LATENCY_WINDOW:
+        WATCHDOG["baseline_ms"] = sum(latencies) / len(latencies)
+
+
+def process_rss_mb() -> float:
+    # 汇总本进程及其子孙进程（浏览器、渲染器）的 RSS，仅 Linux /proc 可用
+    try:
+        page_size = os.sysconf("SC_PAGE_SIZE")
+        stats = {}
+        for name in os.listdir("/proc"):
+            if not name.isdigit():
+                continue
+            try:
+                with open(f"/proc/{name}/stat", "r") as f:
+                    fields = f.read().rsplit(")", 1)[1].split()
+                stats[int(name)] = (int(fields[1]), int(fields[21]))
+            except (OSError, ValueError, IndexError):
+                continue
+    except (OSError, ValueError, AttributeError):
+        return 0.0
+    tree = {os.getpid()}
+    total = 0
+    changed = True
+    while changed:
+        changed = False
+        for pid, (ppid, _) in stats.items():
+            if ppid in tree and pid not in tree:
+                tree.add(pid)
+                changed = True
+    for pid in tree:
+        if pid in stats:
+            total += stats[pid][1] * page_size
+    return total / (1024 * 1024)
+
+
+def renderer_heap_mb(page) -> float:
+    try:
+        used = page.evaluate(
+            "() => (performance.memory ? performance.memory.usedJSHeapSize : 0)"
+        )
+        return float(used or 0) / (1024 * 1024)
+    except PlaywrightError:
+        return 0.0
+
+
+def maybe_recycle(session: dict):
+    page = session["page"]
+    latencies = WATCHDOG["latencies"]
+    avg_ms = sum(latencies) / len(latencies) if latencies else 0.0
+    baseline = WATCHDOG["baseline_ms"]
+    rss = process_rss_mb()
+    heap = renderer_heap_mb(page)
+    reason = ""
+    level = "page"
+    # 滞回：回收后至少导航 RECYCLE_COOLDOWN 次才再按内存回收，且 RSS 需比回收后的水位
+    # 再高出阈值的 10%，避免回收释放不足时每次导航前都重建上下文
+    cooled = WATCHDOG["navigations"] >= RECYCLE_COOLDOWN
+    rss_limit = max(RECYCLE_RSS_MB, WATCHDOG["rss_floor_mb"] + RECYCLE_RSS_MB * 0.1)
+    if RECYCLE_RSS_MB and cooled and rss >= rss_limit:
+        reason, level = f"进程 RSS {rss:.0f}MB", "context"
+    elif (
+        baseline
+        and len(latencies) == LATENCY_WINDOW
+        and avg_ms >= baseline * RECYCLE_LATENCY_FACTOR
+    ):
+        reason = f"导航延迟 {avg_ms:.0f}ms（基线 {baseline:.0f}ms）"
+        level = "context"
+    elif RECYCLE_HEAP_MB and cooled and heap >= RECYCLE_HEAP_MB:
+        reason = f"渲染器堆 {heap:.0f}MB"
+    elif RECYCLE_NAVIGATIONS and WATCHDOG["navigations"] >= RECYCLE_NAVIGATIONS:
+        reason = f"已导航 {WATCHDOG['navigations']} 次"
+    if not reason:
+        return page
+    print(f"[watchdog] {reason}，回收{'上下文' if level == 'context' else '页面'}")
+    try:
+        page.close()
+    except PlaywrightError:
+        pass
+    if level == "context":
         try:
-            page.unroute("**/*")
+            session["context"].close()
         except PlaywrightError:
             pass
+        session["context"] = new_browser_context(
+            session["browser"], os.getenv("YANYUE_USER_AGENT", YANYUE_USER_AGENT)
+        )
+        WATCHDOG["context_recycles"] += 1
+        WATCHDOG["baseline_ms"] = 0.0
+    else:
+        WATCHDOG["page_recycles"] += 1
+    session["page"] = open_page(session["context"])
+    WATCHDOG["navigations"] = 0
+    WATCHDOG["latencies"] = []
+    WATCHDOG["rss_floor_mb"] = process_rss_mb()
+    print(f"[watchdog] 回收后 RSS {WATCHDOG['rss_floor_mb']:.0f}MB")
+    return session["page"]
+
+
+# 分区定义：品牌目录 -> 产品列表 -> 详情/OCR 流水线按分区参数化
+SECTIONS = [
+    {
+        "name": "tobacco",
+        "url": TOBACCO_URL,
+        "output_dir": "yanyue_tobacco_output",
+        "scraper": scrape_tobacco_brands,
+        "headers": ("name", "href", "tab"),
+        "brand_pattern": r"/sort/(\d+)",
+        "dir_prefix": "sort",
+        "listing_selector": "#left #prowrap",
+        "product_prefix": "/product/",
+    },
+    {
+        "name": "hnb",
+        "url": HNB_URL,
+        "output_dir": "yanyue_hnb_output",
+        "scraper": scrape_hnb,
+        "headers": ("name", "href", "section"),
+        "brand_pattern": r"/sorte/(\d+)",
+        "dir_prefix": "sorte",
+        "listing_selector": "#left #prowrap",
+        "product_prefix": "/product/",
+    },
+    {
+        "name": "e",
+        "url": E_URL,
+        "output_dir": "yanyue_e_output",
+        "scraper": scrape_e,
+        "headers": ("name", "href", "section"),
+        "brand_pattern": r"/sorte/(\d+)",
+        "dir_prefix": "sorte",
+        "listing_selector": "#left #prowrap",
+        "product_prefix": "/product/",
+    },
+]
+
+# 发现阶段无法按品牌名归属的产品不属于任何分区，单独存放而不混入传统烟目录
+UNASSIGNED_SECTION = {"name": "unassigned", "output_dir": "yanyue_unassigned_output"}
+
+DETAIL_HEADERS = (
+    "name",
+    "href",
+    "heat",
+    "kouwei",
+    "waiguan",
+    "xingjiabi",
+    "zonghe",
+    "type",
+    "tar",
+    "nicotine",
+    "co",
+    "length",
+    "filter_length",
+    "circumference",
+    "packaging",
+    "main_color",
+    "sub_color",
+    "per_pack_count",
+    "packs_per_carton",
+    "pack_price",
+    "carton_price",
+    "pack_barcode",
+)
 
-        def route_handler(route, request):
-            try:
-                rt = request.resource_type
-                url = request.url or ""
-                # 放行 genpic 反爬数字图片，其它图片仍阻断
-                if rt == "image":
-                    if "genpic" in url:
-                        route.continue_()
-                    else:
-                        route.abort()
-                    return
-                if rt in BLOCKED_TYPES and not (rt == "stylesheet"):
-                    route.abort()
-                else:
-                    route.continue_()
-            except PlaywrightError:
-                route.continue_()
 
-        page.route("**/*", route_handler)
+def env_int(name: str, default: int | None = None) -> int | None:
+    value = os.getenv(name, "")
+    try:
+        return int(value) if value.strip() else default
+    except ValueError:
+        return default
 
-        for t in targets:
-            ensure_dir(t["output_dir"])
-            ok = navigate_and_wait(
-                page, t["url"], retries=1
-            )  # 每次导航后统一 Crawl-delay
-            if not ok:
-                print(f"导航异常: 无法进入 {t['url']}。继续抓取当前页面状态。")
 
-            brands = t["scraper"](page)
-            print(f"[{t['name']}] 抓取到品牌/目录数: {len(brands)}")
-            out_json = os.path.join(t["output_dir"], f"brands_{t['name']}.json")
-            out_csv = os.path.join(t["output_dir"], f"brands_{t['name']}.csv")
-            save_brands(brands, out_json, out_csv, headers=t["headers"])
-            page.screenshot(
-                path=os.path.join(t["output_dir"], f"yanyue_{t['name']}.png"),
-                full_page=True,
-            )
+def interleave(*queues):
+    # 轮转合并各分区的品牌队列：A1, B1, C1, A2, B2, ...
+    for group in zip_longest(*queues):
+        for item in group:
+            if item is not None:
+                yield item
 
-        # --- 抓取所有传统烟品牌的产品与详情 ---
-        brands_json_path = os.path.join("yanyue_tobacco_output", "brands_tobacco.json")
-        tobacco_brands = load_json_if_exists(brands_json_path)
-        if tobacco_brands:
-            print(f"[tobacco] 复用已有品牌列表: {len(tobacco_brands)}")
-        else:
-            ok = navigate_and_wait(page, TOBACCO_URL, retries=1)
-            if not ok:
-                print("[tobacco] 导航失败，仍尝试从当前页面抓取品牌。")
-            tobacco_brands = scrape_tobacco_brands(page)
-            print(f"[tobacco] 需要抓取的品牌数: {len(tobacco_brands)}")
 
-        products_max_pages_env = os.getenv("YANYUE_LIMIT_PRODUCT_PAGES", "")
-        try:
-            products_max_pages = (
-                int(products_max_pages_env) if products_max_pages_env.strip() else 100
-            )
-        except ValueError:
-            products_max_pages = 100
+def section_by_name(name: str) -> dict | None:
+    return next((t for t in (*SECTIONS, UNASSIGNED_SECTION) if t["name"] == name), None)
 
-        limit_details_env = os.getenv("YANYUE_LIMIT_DETAILS", "")
-        try:
-            limit_details = (
-                int(limit_details_env) if limit_details_env.strip() else None
+
+def brand_paths(section: dict, brand_key: str) -> dict:
+    brand_dir = os.path.join(section["output_dir"], brand_key)
+    return {
+        "brand_dir": brand_dir,
+        "stream_ndjson": os.path.join(brand_dir, f"{brand_key}_details_stream.ndjson"),
+        "stream_csv": os.path.join(brand_dir, f"{brand_key}_details_stream.csv"),
+    }
+
+
+def scrape_detail(
+    page,
+    section: dict,
+    brand_key: str,
+    url: str,
+    run: dict,
+    retry_entry: dict | None = None,
+):
+    # 抓取单个详情页并追加到品牌详情流；导航失败时放入重试队列
+    # section 为 None 时（发现阶段得到的 URL）按详情页 brand 字段归入品牌
+    ok = navigate_and_wait(page, url, content_selector="#product_detail")
+    if not ok:
+        print(f"[detail:{brand_key}] 产品页暂不可达，延后重试: {url}")
+        entry = dict(retry_entry or {})
+        entry.update(
+            {
+                "kind": "detail",
+                "section": section["name"] if section else "",
+                "brand_key": brand_key,
+                "url": url,
+            }
+        )
+        enqueue_retry(run["retry_queue"], entry)
+        return None
+    d = scrape_product_detail(page)
+    d["scraped_at"] = int(time.time())
+    if section is None:
+        section, brand_key = resolve_brand(run, d.get("brand", ""))
+    paths = brand_paths(section, brand_key)
+    ensure_dir(paths["brand_dir"])
+    append_ndjson(paths["stream_ndjson"], d)
+    append_csv_row(paths["stream_csv"], DETAIL_HEADERS, d)
+    run["brand_details"].setdefault(brand_key, (section, []))[1].append(d)
+    if paths["brand_dir"] in run["owner_records"]:
+        run["owner_records"][paths["brand_dir"]][d["href"]] = d
+    pid = product_id_from_href(url)
+    if pid:
+        index_product(
+            run["product_index"], PRODUCT_INDEX_PATH, pid, paths["brand_dir"], d
+        )
+        for ref_section, ref_key in run["deferred_refs"].pop(pid, []):
+            append_ref_record(run, ref_section, ref_key, run["product_index"][pid])
+    return d
+
+
+def append_ref_record(run: dict, section: dict, brand_key: str, entry: dict):
+    record = indexed_record(run, entry)
+    if not record:
+        return
+    paths = brand_paths(section, brand_key)
+    d = dict(record)
+    if entry.get("owner") != paths["brand_dir"]:
+        d["ref"] = entry.get("owner", "")
+    append_ndjson(paths["stream_ndjson"], d)
+    append_csv_row(paths["stream_csv"], DETAIL_HEADERS, d)
+    run["brand_details"].setdefault(brand_key, (section, []))[1].append(d)
+    run["saved_fetches"] += 1
+
+
+def process_retries(page, run: dict, until: float):
+    for e in take_due_retries(run["retry_queue"], until):
+        section = section_by_name(e.get("section", ""))
+        if not section and e.get("brand_key"):
+            # 分区定义已不存在：保留条目并提示，避免从持久化队列中静默丢失
+            print(f"[retry] 未知分区 {e.get('section')!r}，保留待处理: {e.get('url')}")
+            run["retry_queue"].append(e)
+            save_retry_queue(RETRY_QUEUE_PATH, run["retry_queue"])
+            continue
+        if budget_exhausted():
+            # 预算耗尽：放回队列留待下次运行
+            run["retry_queue"].append(e)
+            save_retry_queue(RETRY_QUEUE_PATH, run["retry_queue"])
+            continue
+        wait_ms = int((e.get("next_at", 0) - time.time()) * 1000)
+        if wait_ms > 0:
+            page.wait_for_timeout(wait_ms)
+        print(f"[retry] 第 {e.get('attempts', 0)} 次重试: {e.get('url')}")
+        if e.get("kind") == "brand":
+            run["done_brand_keys"].discard(e.get("brand_key"))
+            collect_brand(
+                page,
+                section,
+                {"name": e.get("name", ""), "href": e.get("url", "")},
+                "retry",
+                run,
+                retry_entry=e,
             )
-        except ValueError:
-            limit_details = None
+            continue
+        scrape_detail(page, section, e["brand_key"], e["url"], run, retry_entry=e)
+
 
-        # 限制品牌数量以便快速验证（可选）
-        limit_brands_env = os.getenv("YANYUE_LIMIT_BRANDS", "")
+# 预算调度：按价值排序详情抓取，时间/请求预算耗尽时干净停止
+def detail_priority(record: dict | None, now: float) -> tuple | None:
+    # 未抓取过 -> (0, ...)；过期 -> (1, -热度×天数)；其余仅在设置预算时 -> (2, -天数)
+    if not record:
+        return (0, 0.0)
+    age_days = (now - float(record.get("scraped_at") or 0)) / 86400
+    if age_days >= STALE_DAYS:
         try:
-            limit_brands = int(limit_brands_env) if limit_brands_env.strip() else None
+            heat = float(record.get("heat") or 0)
         except ValueError:
-            limit_brands = None
-        if limit_brands is not None:
-            tobacco_brands = tobacco_brands[:limit_brands]
-            print(f"[tobacco] 将处理前 {limit_brands} 个品牌")
-
-        total_brands = len(tobacco_brands)
-        for i, b in enumerate(tobacco_brands, 1):
-            href = b.get("href") or ""
-            name = b.get("name") or "unknown"
-            m = re.search(r"/sort/(\d+)", href)
-            if not m:
-                continue
-            brand_id = m.group(1)
-            brand_url = href if href.startswith("http") else urljoin(BASE_URL, href)
-            brand_dir = os.path.join("yanyue_tobacco_output", f"sort_{brand_id}")
-            ensure_dir(brand_dir)
+            heat = 0.0
+        return (1, -(math.log1p(heat) + 1) * age_days)
+    if BUDGET_SECONDS or BUDGET_REQUESTS:
+        return (2, -age_days)
+    return None
 
-            print(
-                f"[brand {i}/{total_brands} id:{brand_id}] 进入品牌页: {name} -> {brand_url}"
-            )
-            navigate_and_wait(page, brand_url, content_selector="#prowrap", retries=1)
+
+def schedule_detail(
+    run: dict, section: dict, brand_key: str, url: str, idx: int, record: dict | None
+):
+    priority = detail_priority(record, time.time())
+    if priority is None:
+        return
+    run["seq"] += 1
+    heapq.heappush(
+        run["pending"],
+        (
+            priority,
+            run["seq"],
+            section["name"] if section else "",
+            brand_key,
+            url,
+            idx,
+        ),
+    )
+
+
+def run_scheduler(run: dict):
+    # 页面可能在循环中被回收，每轮从 run["session"] 取当前页面，不接收外部页面引用
+    pending = run["pending"]
+    done = 0
+    while pending:
+        page = maybe_recycle(run["session"])
+        process_retries(page, run, time.time())
+        if budget_exhausted():
+            print(f"[budget] 预算已用尽，剩余 {len(pending)} 个详情留待下次运行")
+            break
+        priority, _, section_name, brand_key, url, idx = heapq.heappop(pending)
+        section = section_by_name(section_name)
+        label = ("新", "过期", "刷新")[priority[0]]
+        print(f"[detail:{brand_key}] ({label}, 剩余 {len(pending)}) 进入: {url}")
+        d = scrape_detail(page, section, brand_key, url, run)
+        if d is None:
+            continue
+        done += 1
+        if 0 <= idx < 3:
             page.screenshot(
-                path=os.path.join(brand_dir, f"brand_sort_{brand_id}.png"),
+                path=os.path.join(
+                    brand_paths(section, brand_key)["brand_dir"], f"product_{idx + 1}.png"
+                ),
                 full_page=True,
             )
+    print(f"[budget] 本次抓取详情: {done}，请求数: {BUDGET['requests']}")
 
-            products_json_path = os.path.join(
-                brand_dir, f"sort_{brand_id}_products.json"
-            )
-            products_csv_path = os.path.join(brand_dir, f"sort_{brand_id}_products.csv")
-            products = load_json_if_exists(products_json_path)
-            if products:
-                print(f"[brand:{brand_id}] 复用已存在产品列表: {len(products)}")
-            else:
-                products = scrape_brand_products(
-                    page, brand_url, max_pages=products_max_pages
-                )
-                print(f"[brand:{brand_id}] 产品列表数量: {len(products)}")
-            # 确保产品列表持久化（复用时也生成CSV）
-            save_brands(
-                products,
-                products_json_path,
-                products_csv_path,
-                headers=("name", "href"),
-            )
 
-            details = []
-            details_stream_ndjson_path = os.path.join(
-                brand_dir, f"sort_{brand_id}_details_stream.ndjson"
-            )
-            details_stream_csv_path = os.path.join(
-                brand_dir, f"sort_{brand_id}_details_stream.csv"
+# URL 发现：优先读取 robots.txt/sitemap，其次按 ID 区间轻量探测，绕过列表分页
+UNASSIGNED_BRAND_KEY = "unassigned"
+
+
+def fetch_text(page, url: str) -> tuple[int, str]:
+    # 轻量请求：复用浏览器上下文的 Cookie/UA，不渲染页面，仍计入速率预算
+    wait_for_rate_budget(page)
+    try:
+        resp = page.context.request.get(url, timeout=30000, max_redirects=0)
+        status, text = resp.status, resp.text()
+    except PlaywrightError:
+        status, text = 0, ""
+    record_navigation(page, 0 < status < 500 and status != 429)
+    return status, text
+
+
+def add_discovered(found: dict, url: str):
+    pid = product_id_from_href(url)
+    if pid:
+        found["products"].setdefault(pid, url)
+        return
+    for t in SECTIONS:
+        if re.search(t["brand_pattern"], url) and url not in found["brands"]:
+            found["brands"].append(url)
+            return
+
+
+def discover_from_sitemaps(page, found: dict) -> int:
+    # 返回本次 sitemap 中列出的产品 URL 数
+    status, robots = fetch_text(page, f"{BASE_URL}/robots.txt")
+    sitemaps = re.findall(r"(?im)^\s*sitemap:\s*(\S+)", robots) if status == 200 else []
+    if not sitemaps:
+        sitemaps = [f"{BASE_URL}/sitemap.xml"]
+    visited = set()
+    listed = 0
+    while sitemaps and not budget_exhausted():
+        url = sitemaps.pop(0)
+        if url in visited:
+            continue
+        visited.add(url)
+        status, xml = fetch_text(page, url)
+        if status != 200:
+            continue
+        locs = [
+            html.unescape(loc)
+            for loc in re.findall(r"<loc>\s*([^<]+?)\s*</loc>", xml)
+        ]
+        # sitemap 索引文件继续展开子 sitemap
+        if "<sitemapindex" in xml:
+            sitemaps.extend(locs)
+            continue
+        for loc in locs:
+            add_discovered(found, loc)
+            if product_id_from_href(loc):
+                listed += 1
+    return listed
+
+
+def probe_product_ids(page, found: dict, product_index: dict):
+    m = re.match(r"^\s*(\d+)\s*-\s*(\d+)\s*$", PROBE_RANGE)
+    if not m:
+        return
+    start, end = int(m.group(1)), int(m.group(2))
+    next_id = max(start, int(found.get("probe_next") or start))
+    probed = 0
+    while next_id <= end and probed < PROBE_LIMIT and not budget_exhausted():
+        pid = str(next_id)
+        if pid not in found["products"] and pid not in product_index:
+            url = f"{BASE_URL}/product/{pid}"
+            status, body = fetch_text(page, url)
+            if status == 200 and "product_detail" in body:
+                found["products"][pid] = url
+            probed += 1
+        next_id += 1
+    found["probe_next"] = next_id
+    print(f"[discover] ID 探测 {probed} 个，下次从 {next_id} 开始")
+
+
+def discover_urls(page, run: dict) -> dict:
+    found = load_json_if_exists(DISCOVERY_PATH) or {}
+    found.setdefault("products", {})
+    found.setdefault("brands", [])
+    before = len(found["products"])
+    run["sitemap_products"] = discover_from_sitemaps(page, found)
+    probe_product_ids(page, found, run["product_index"])
+    try:
+        with open(DISCOVERY_PATH, "w", encoding="utf-8") as f:
+            json.dump(found, f, ensure_ascii=False, indent=2)
+    except Exception:
+        pass
+    print(
+        f"[discover] 已知产品 URL: {len(found['products'])}（新增 {len(found['products']) - before}），"
+        f"品牌 URL: {len(found['brands'])}"
+    )
+    return found
+
+
+def resolve_brand(run: dict, brand_name: str) -> tuple:
+    # 根据详情页 brand 字段回填品牌归属；无法匹配时归入与分区无关的 unassigned
+    hit = run["brand_names"].get((brand_name or "").strip())
+    if hit:
+        return hit
+    return UNASSIGNED_SECTION, UNASSIGNED_BRAND_KEY
+
+
+def owner_section(owner: str) -> tuple:
+    # 全局索引的 owner 为品牌目录（如 yanyue_tobacco_output/sort_14）
+    out_dir, brand_key = os.path.split(owner)
+    section = next(
+        (t for t in (*SECTIONS, UNASSIGNED_SECTION) if t["output_dir"] == out_dir),
+        None,
+    )
+    return section, brand_key
+
+
+def indexed_record(run: dict, entry: dict) -> dict | None:
+    # 从产品所属品牌的详情流读取最近一次抓取的记录（按品牌目录缓存）
+    owner = entry.get("owner", "")
+    records = run["owner_records"].get(owner)
+    if records is None:
+        section, brand_key = owner_section(owner)
+        records = {}
+        if section:
+            records = load_ndjson_records(brand_paths(section, brand_key)["stream_ndjson"])
+        run["owner_records"][owner] = records
+    return records.get(entry.get("href", ""))
+
+
+def schedule_discovered(run: dict):
+    # 发现阶段得到的产品：未入索引的抓取后按详情页 brand 字段归入品牌；
+    # 已入索引、但本次没有品牌列表调度的，按所属品牌的详情流记录参与过期刷新
+    limit_details = run["limit_details"]
+    new_count = 0
+    for pid, url in run["discovered"]["products"].items():
+        if pid in run["deferred_refs"] or pid in run["limited_ids"]:
+            continue
+        existing = run["product_index"].get(pid)
+        if existing:
+            section, brand_key = owner_section(existing.get("owner", ""))
+            if not section:
+                continue
+            run["deferred_refs"][pid] = []
+            schedule_detail(
+                run, section, brand_key, url, -1, indexed_record(run, existing)
             )
-            seen_detail_hrefs = load_ndjson_hrefs(details_stream_ndjson_path)
-            detail_headers = (
-                "name",
-                "href",
-                "heat",
-                "kouwei",
-                "waiguan",
-                "xingjiabi",
-                "zonghe",
-                "type",
-                "tar",
-                "nicotine",
-                "co",
-                "length",
-                "filter_length",
-                "circumference",
-                "packaging",
-                "main_color",
-                "sub_color",
-                "per_pack_count",
-                "packs_per_carton",
-                "pack_price",
-                "carton_price",
-                "pack_barcode",
+            continue
+        # 未归属品牌的新产品同样受 YANYUE_LIMIT_DETAILS 限制
+        if limit_details is not None and new_count >= limit_details:
+            continue
+        new_count += 1
+        run["deferred_refs"][pid] = []
+        schedule_detail(run, None, "", url, -1, None)
+
+
+def collect_brand(
+    page, section: dict, b: dict, pos: str, run: dict, retry_entry: dict | None = None
+):
+    href = b.get("href") or ""
+    name = b.get("name") or "unknown"
+    tag = section["name"]
+    m = re.search(section["brand_pattern"], href)
+    if not m:
+        return
+    brand_id = m.group(1)
+    prefix = section["dir_prefix"]
+    # 同一品牌出现在多个标签/分区下时只抓取一次
+    brand_key = f"{prefix}_{brand_id}"
+    if brand_key in run["done_brand_keys"]:
+        print(f"[{tag}:{brand_id}] 已在其它标签下处理，跳过: {name}")
+        run["saved_brands"] += 1
+        return
+    run["done_brand_keys"].add(brand_key)
+    brand_url = href if href.startswith("http") else urljoin(BASE_URL, href)
+    paths = brand_paths(section, brand_key)
+    brand_dir = paths["brand_dir"]
+    ensure_dir(brand_dir)
+
+    products_json_path = os.path.join(brand_dir, f"{brand_key}_products.json")
+    products_csv_path = os.path.join(brand_dir, f"{brand_key}_products.csv")
+    products = load_json_if_exists(products_json_path)
+    discovered = run["discovered"]["products"]
+    if products:
+        print(f"[{tag}:{brand_id}] 复用已存在产品列表: {len(products)}")
+    else:
+        if run["skip_listings"]:
+            # 产品 URL 已由本次 sitemap 覆盖并会统一调度，品牌列表页仅作一致性校验
+            return
+        if budget_exhausted():
+            return
+        # 仅在需要产品列表时才进入品牌页
+        print(f"[{tag} {pos} id:{brand_id}] 进入品牌页: {name} -> {brand_url}")
+        ok = navigate_and_wait(
+            page, brand_url, content_selector=section["listing_selector"]
+        )
+        if not ok:
+            print(f"[{tag}:{brand_id}] 品牌页暂不可达，延后重试: {brand_url}")
+            entry = dict(retry_entry or {})
+            entry.update(
+                {
+                    "kind": "brand",
+                    "section": tag,
+                    "brand_key": brand_key,
+                    "url": brand_url,
+                    "name": name,
+                }
             )
-            for idx, p in enumerate(products):
-                if limit_details is not None and idx >= limit_details:
-                    break
-                url = p.get("href")
-                if not url:
-                    continue
-                if url in seen_detail_hrefs:
-                    print(f"[detail:{brand_id}] 已存在，跳过: {url}")
-                    continue
-                print(f"[detail:{brand_id}] ({idx + 1}/{len(products)}) 进入: {url}")
-                ok2 = navigate_and_wait(
-                    page, url, content_selector="#product_detail", retries=2
+            enqueue_retry(run["retry_queue"], entry)
+            return
+        page.screenshot(
+            path=os.path.join(brand_dir, f"brand_{brand_key}.png"),
+            full_page=True,
+        )
+        products = scrape_brand_products(
+            page,
+            brand_url,
+            max_pages=run["products_max_pages"],
+            listing_selector=section["listing_selector"],
+            product_prefix=section["product_prefix"],
+        )
+        print(f"[{tag}:{brand_id}] 产品列表数量: {len(products)}")
+        if discovered:
+            missing = [
+                p["href"]
+                for p in products
+                if product_id_from_href(p.get("href", "")) not in discovered
+            ]
+            print(f"[check:{brand_id}] 列表中未被发现阶段覆盖的产品: {len(missing)}")
+            for href in missing:
+                add_discovered(run["discovered"], href)
+    # 确保产品列表持久化（复用时也生成CSV）
+    save_brands(
+        products,
+        products_json_path,
+        products_csv_path,
+        headers=("name", "href"),
+    )
+
+    seen_records = load_ndjson_records(paths["stream_ndjson"])
+    seen_product_ids = set()
+    product_index = run["product_index"]
+    limit_details = run["limit_details"]
+    for idx, p in enumerate(products):
+        if limit_details is not None and idx >= limit_details:
+            # 被品牌限额截掉的产品也不应经由发现阶段被抓取
+            for rest in products[idx:]:
+                rest_pid = product_id_from_href(rest.get("href", ""))
+                if rest_pid:
+                    run["limited_ids"].add(rest_pid)
+            break
+        url = p.get("href")
+        if not url:
+            continue
+        pid = product_id_from_href(url)
+        if pid:
+            if pid in seen_product_ids:
+                continue
+            seen_product_ids.add(pid)
+            existing = product_index.get(pid)
+            if url not in seen_records and existing and indexed_record(run, existing):
+                # 其它品牌已抓取过该产品：引用已有记录，不再导航与 OCR
+                append_ref_record(run, section, brand_key, existing)
+                print(f"[detail:{brand_id}] 复用全局索引记录: {url}")
+                continue
+            if existing and existing.get("owner") != brand_dir:
+                # 刷新由产品所属品牌负责调度
+                continue
+            if pid in run["deferred_refs"]:
+                # 本次运行已由其它品牌调度：抓取完成后再写入引用
+                if url not in seen_records:
+                    run["deferred_refs"][pid].append((section, brand_key))
+                continue
+            run["deferred_refs"][pid] = []
+        schedule_detail(run, section, brand_key, url, idx, seen_records.get(url))
+
+
+def main():
+    with sync_playwright() as p:
+        # 使用常量 UA 与 Crawl-delay 配置
+        chosen_ua = os.getenv("YANYUE_USER_AGENT", YANYUE_USER_AGENT)
+        # 使用环境可覆盖的 Crawl-delay 与随机抖动
+
+        load_request_rules()
+        browser = p.chromium.launch(headless=True)
+        session = {
+            "browser": browser,
+            "context": new_browser_context(browser, chosen_ua),
+        }
+        session["page"] = open_page(session["context"])
+        page = session["page"]
+
+        run = {
+            "product_index": load_product_index(PRODUCT_INDEX_PATH),
+            "owner_records": {},
+            "products_max_pages": env_int("YANYUE_LIMIT_PRODUCT_PAGES", 100),
+            "limit_details": env_int("YANYUE_LIMIT_DETAILS"),
+            "saved_fetches": 0,
+            "saved_brands": 0,
+            "done_brand_keys": set(),
+            "retry_queue": load_retry_queue(RETRY_QUEUE_PATH),
+            "pending": [],
+            "seq": 0,
+            "brand_details": {},
+            "deferred_refs": {},
+            "brand_names": {},
+            "limited_ids": set(),
+            "sitemap_products": 0,
+            "skip_listings": False,
+            "session": session,
+        }
+        compact_product_index(PRODUCT_INDEX_PATH, run["product_index"])
+        print(f"[index] 全局产品索引: {len(run['product_index'])}")
+        if run["retry_queue"]:
+            print(f"[retry] 上次运行遗留待重试: {len(run['retry_queue'])}")
+
+        # 限制品牌数量以便快速验证（可选，按分区分别生效）
+        limit_brands = env_int("YANYUE_LIMIT_BRANDS")
+        queues = []
+        for t in SECTIONS:
+            ensure_dir(t["output_dir"])
+            out_json = os.path.join(t["output_dir"], f"brands_{t['name']}.json")
+            out_csv = os.path.join(t["output_dir"], f"brands_{t['name']}.csv")
+            ok = navigate_and_wait(
+                page, t["url"], retries=1
+            )  # 每次导航前统一 Crawl-delay
+            if not ok:
+                print(f"导航异常: 无法进入 {t['url']}。继续抓取当前页面状态。")
+
+            brands = t["scraper"](page)
+            print(f"[{t['name']}] 抓取到品牌/目录数: {len(brands)}")
+            if brands:
+                save_brands(brands, out_json, out_csv, headers=t["headers"])
+                page.screenshot(
+                    path=os.path.join(t["output_dir"], f"yanyue_{t['name']}.png"),
+                    full_page=True,
                 )
-                if not ok2:
-                    print(f"[detail:{brand_id}] 跳过无法进入的产品页: {url}")
-                    continue
-                d = scrape_product_detail(page, img_save_dir=brand_dir)
-                details.append(d)
-                append_ndjson(details_stream_ndjson_path, d)
-                append_csv_row(details_stream_csv_path, detail_headers, d)
-                seen_detail_hrefs.add(url)
-                # 每个详情后增加人类化等待（Crawl-delay + 抖动）
-                page.wait_for_timeout(CRAWL_DELAY_MS + random.randint(0, DELAY_JITTER_MS))
-                if idx < 3:
-                    page.screenshot(
-                        path=os.path.join(brand_dir, f"product_{idx + 1}.png"),
-                        full_page=True,
+            else:
+                brands = load_json_if_exists(out_json)
+                if brands:
+                    print(f"[{t['name']}] 复用已有品牌列表: {len(brands)}")
+            for b in brands:
+                m = re.search(t["brand_pattern"], b.get("href") or "")
+                if m and b.get("name"):
+                    run["brand_names"].setdefault(
+                        b["name"], (t, f"{t['dir_prefix']}_{m.group(1)}")
                     )
-            print(f"[detail:{brand_id}] 完成产品详情抓取: {len(details)}")
+            if limit_brands is not None:
+                brands = brands[:limit_brands]
+                print(f"[{t['name']}] 将处理前 {limit_brands} 个品牌")
+            total = len(brands)
+            queues.append(
+                [(t, b, f"{i}/{total}") for i, b in enumerate(brands, 1)]
+            )
+
+        # --- URL 发现阶段：sitemap / ID 探测，品牌列表页退为一致性校验 ---
+        run["discovered"] = discover_urls(page, run)
+        # 只有本次 sitemap 确实列出了产品、且发现结果会被调度（未限制品牌数）时，
+        # 才跳过品牌列表页；否则（如仅有上次提交的 yanyue_discovery.json）照常抓取列表
+        run["skip_listings"] = (
+            limit_brands is None and run["sitemap_products"] > 0 and not VERIFY_LISTINGS
+        )
+        if limit_brands is None:
+            known = {b.get("href") for q in queues for _, b, _ in q}
+            for url in run["discovered"]["brands"]:
+                if url in known:
+                    continue
+                # 品牌列表中没有的 URL 无法判断分区（hnb 与 e 共用 /sorte/），
+                # 统一归入第一个匹配的分区，而不是同时加入多个分区的队列
+                for q, t in zip(queues, SECTIONS):
+                    if re.search(t["brand_pattern"], url):
+                        q.append((t, {"name": "", "href": url}, "sitemap"))
+                        break
+
+        # --- 各分区品牌交错收集产品列表，共享同一速率预算 ---
+        for section, b, pos in interleave(*queues):
+            page = maybe_recycle(session)
+            collect_brand(page, section, b, pos, run)
+
+        if limit_brands is None:
+            schedule_discovered(run)
+
+        # --- 按优先级抓取详情：新产品 > 过期（按热度×天数）> 其余 ---
+        print(f"[budget] 待调度详情: {len(run['pending'])}")
+        run_scheduler(run)
+
+        # 调度期间页面可能已被回收，重新取当前页面；
+        # 运行结束前重试到期（或一个退避周期内到期）的失败 URL，其余留待下次运行
+        page = maybe_recycle(session)
+        process_retries(page, run, time.time() + RETRY_BASE_MS / 1000)
+        if run["pending"]:
+            # 重试成功的品牌列表会追加新的详情调度，本次运行内一并抓取
+            print(f"[budget] 重试后新增待调度详情: {len(run['pending'])}")
+            run_scheduler(run)
+        if run["retry_queue"]:
+            print(f"[retry] 剩余待重试: {len(run['retry_queue'])}")
+        for brand_key, (section, details) in run["brand_details"].items():
+            brand_dir = brand_paths(section, brand_key)["brand_dir"]
+            print(f"[detail:{brand_key}] 完成产品详情抓取: {len(details)}")
             save_brands(
                 details,
-                os.path.join(brand_dir, f"sort_{brand_id}_details.json"),
-                os.path.join(brand_dir, f"sort_{brand_id}_details.csv"),
-                headers=detail_headers,
+                os.path.join(brand_dir, f"{brand_key}_details.json"),
+                os.path.join(brand_dir, f"{brand_key}_details.csv"),
+                headers=DETAIL_HEADERS,
             )
-
+        print(
+            f"[index] 全局去重节省详情抓取: {run['saved_fetches']} 次，"
+            f"跳过重复品牌: {run['saved_brands']} 个"
+        )
+        report_requests()
+        print(
+            f"[watchdog] 页面回收 {WATCHDOG['page_recycles']} 次，"
+            f"上下文回收 {WATCHDOG['context_recycles']} 次"
+        )
         browser.close()
 
 
@@ -1,88 +1,227 @@
-import os
+"""批量重新识别 genpic 图片（与 main.py 共用预处理、纠错与字段清洗）。
+
+图片来自内容寻址存储 yanyue_genpic/，每张唯一图片只识别一次，
+再按索引中的 (href, field, idx) 拼回字段值。
+
+用法：
+    python ocr_test.py                      # 识别存储中的全部图片
+    python ocr_test.py --workers 8 --patch  # 并行识别并回写详情流
+"""
+import argparse
+import csv
 import glob
-from io import BytesIO
-from PIL import Image, ImageOps, ImageFilter
-import ddddocr
-
-# 目标图片目录（可按需切换品牌目录）
-image_dir = 'yanyue_tobacco_output/sort_14/genpic'
-image_extensions = ['*.jpg', '*.jpeg', '*.png']
-
-# 初始化 ddddocr（通用 OCR，支持中英文与符号）
-reader = ddddocr.DdddOcr(ocr=True, show_ad=False)
-
-# 数字纠错映射（常见误读）：Z->2, S->8, I/l->1, O/o->0, B->8, G->6
-DIGIT_MAP = str.maketrans({
-    'Z': '2', 'S': '8', 'I': '1', 'l': '1', 'O': '0', 'o': '0', 'B': '8', 'G': '6'
-})
-
-def normalize_ocr_digits(s: str) -> str:
-    try:
-        return s.translate(DIGIT_MAP)
-    except Exception:
-        return s
-
-# 图像预处理（与 main.py 一致）：灰度、自动对比度、小图放大、轻度锐化
-def preprocess_for_ocr(img_path: str):
-    try:
-        img = Image.open(img_path)
-        img = ImageOps.grayscale(img)
-        img = ImageOps.autocontrast(img)
-        w, h = img.size
-        if max(w, h) < 120:
-            img = img.resize((w * 2, h * 2), Image.LANCZOS)
-        img = img.filter(ImageFilter.UnsharpMask(radius=1, percent=150, threshold=3))
-        return img
-    except Exception:
-        return None
-
-# 收集图片路径
-image_paths = []
-for ext in image_extensions:
-    image_paths.extend(glob.glob(os.path.join(image_dir, ext)))
-    image_paths.extend(glob.glob(os.path.join(image_dir, ext.upper())))
-
-if not image_paths:
-    print(f"在目录 {image_dir} 下未找到任何图片文件（支持 jpg, jpeg, png）。")
-else:
-    print(f"共找到 {len(image_paths)} 张图片，开始 OCR 识别...\n")
-    for img_path in sorted(image_paths):
-        print(f"正在处理图片：{img_path}")
-        try:
-            # 预处理 + bytes
-            img = preprocess_for_ocr(img_path)
-            if img is not None:
-                buf = BytesIO()
-                img.save(buf, format='PNG')
-                img_bytes = buf.getvalue()
-            else:
-                with open(img_path, 'rb') as f:
-                    img_bytes = f.read()
-
-            # 使用 ddddocr 的 classification 识别单行文本
-            try:
-                raw = reader.classification(img_bytes)
-            except Exception:
-                raw = ''
-
-            raw_fixed = normalize_ocr_digits(raw.replace('￥', '¥'))
-            print(f"识别结果（原始）：'{raw}'")
-            print(f"识别结果（纠错）：'{raw_fixed}'")
-
-            # 数值提取演示：仅保留数字与小数点（价格保留¥）
-            fname = os.path.basename(img_path)
-            if fname.startswith(('pack_price', 'carton_price')):
-                val = ''.join([ch for ch in raw_fixed if (ch.isdigit() or ch in ['.', '¥'])])
-            elif fname.startswith(('pack_barcode', '条装条码')):
-                val = ''.join([ch for ch in raw_fixed if ch.isdigit()])
-            else:
-                val = ''.join([ch for ch in raw_fixed if (ch.isdigit() or ch == '.')])
-                if val.startswith('.') and val[1:].isdigit():
-                    val = '0' + val
-                if val.endswith('.') and val[:-1].isdigit():
-                    val = val[:-1]
-            print(f"数值提取：'{val}'\n")
-        except Exception as e:
-            print(f"处理图片 {img_path} 时出错：{e}\n")
-
-    print("所有图片处理完成。")
\ No newline at end of file
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from main import (
+    DETAIL_HEADERS,
+    GENPIC_INDEX_PATH,
+    clean_ocr_text,
+    genpic_store_path,
+    get_ddddocr_reader,
+    ocr_raw_batch,
+)
+
+# 每个子进程任务处理的图片数（整批解码与预处理）
+CHUNK_SIZE = 64
+
+
+def find_detail_streams() -> list:
+    return sorted(
+        glob.glob(os.path.join("yanyue_*_output", "*", "*_details_stream.ndjson"))
+    )
+
+
+def ocr_chunk(digests: list) -> list:
+    # 在子进程中运行：每个进程各自初始化一次 ddddocr，整块图片批量预处理后识别；
+    # 读取或识别失败直接抛出，由主进程报告，不以空结果冒充识别值；
+    # 计时不含模型加载，只统计读取、预处理与识别
+    reader = get_ddddocr_reader()
+    if reader is None:
+        raise RuntimeError("ddddocr 不可用")
+    started = time.perf_counter()
+    blobs = []
+    for digest in digests:
+        with open(genpic_store_path(digest), "rb") as f:
+            blobs.append(f.read())
+    raws = ocr_raw_batch(reader, blobs)
+    ms = (time.perf_counter() - started) * 1000 / max(len(digests), 1)
+    return [(digest, raw, ms) for digest, raw in zip(digests, raws)]
+
+
+def read_ndjson(path: str) -> list:
+    records = []
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line.strip()))
+                except Exception:
+                    continue
+    return records
+
+
+def write_ndjson(path: str, records: list):
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        for obj in records:
+            f.write(json.dumps(obj, ensure_ascii=False) + "\n")
+    os.replace(tmp, path)
+
+
+def patch_stream(ndjson_path: str, changes: dict) -> int:
+    # changes: href -> {field: value}
+    records = read_ndjson(ndjson_path)
+    patched = 0
+    for obj in records:
+        fields = changes.get(obj.get("href"))
+        if fields:
+            obj.update(fields)
+            patched += 1
+    if patched:
+        write_ndjson(ndjson_path, records)
+        # CSV 详情流由 ndjson 整体重建
+        csv_path = ndjson_path[: -len(".ndjson")] + ".csv"
+        with open(csv_path, "w", newline="", encoding="utf-8") as cf:
+            writer = csv.writer(cf)
+            writer.writerow(list(DETAIL_HEADERS))
+            for obj in records:
+                writer.writerow([obj.get(h, "") for h in DETAIL_HEADERS])
+    return patched
+
+
+def main():
+    parser = argparse.ArgumentParser(description="并行批量重新识别 genpic 图片")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--out", default="ocr_batch_output", help="结果输出目录")
+    parser.add_argument(
+        "--patch",
+        action="store_true",
+        help="将识别结果回写到详情流与 genpic 索引",
+    )
+    args = parser.parse_args()
+
+    entries = read_ndjson(GENPIC_INDEX_PATH)
+    digests = sorted(
+        {
+            e["sha1"]
+            for e in entries
+            if e.get("sha1") and os.path.exists(genpic_store_path(e["sha1"]))
+        }
+    )
+    if not digests:
+        print(f"未找到任何 genpic 图片（索引: {GENPIC_INDEX_PATH}）。")
+        return
+    print(
+        f"索引 {len(entries)} 条、唯一图片 {len(digests)} 张，使用 {args.workers} 个进程识别..."
+    )
+
+    if get_ddddocr_reader() is None:
+        sys.exit("ddddocr 不可用：请先安装并确认可以初始化 OCR 模型。")
+
+    started = time.perf_counter()
+    chunks = [digests[i : i + CHUNK_SIZE] for i in range(0, len(digests), CHUNK_SIZE)]
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        results = [r for chunk in pool.map(ocr_chunk, chunks) for r in chunk]
+    elapsed = time.perf_counter() - started
+    # 未识别出内容的图片不参与回写，避免空结果覆盖已有识别值
+    failed = [digest for digest, raw, _ in results if not raw]
+    if failed:
+        print(f"未识别出内容的图片: {len(failed)}（已跳过）")
+    raw_by_digest = {digest: raw for digest, raw, _ in results if raw}
+    ms_by_digest = {digest: ms for digest, _, ms in results}
+
+    # 同一 (href, field, idx) 以索引中最后一次记录为准，按 idx 顺序拼接字段值
+    latest = {}
+    for e in entries:
+        if e.get("sha1") in ms_by_digest:
+            latest[(e.get("href"), e.get("field"), int(e.get("idx") or 0))] = e
+    texts = {
+        k: clean_ocr_text(k[1], raw_by_digest.get(e["sha1"], ""))
+        for k, e in latest.items()
+    }
+    # 任一分片未识别的字段不参与回写，避免拼出残缺值（统计仍覆盖全部图片）
+    incomplete = {(href, key) for (href, key, _), text in texts.items() if not text}
+    values = {}
+    os.makedirs(args.out, exist_ok=True)
+    results_csv = os.path.join(args.out, "ocr_results.csv")
+    with open(results_csv, "w", newline="", encoding="utf-8") as cf:
+        writer = csv.writer(cf)
+        writer.writerow(["href", "field", "idx", "sha1", "raw", "text"])
+        for (href, key, idx), e in sorted(latest.items()):
+            raw = raw_by_digest.get(e["sha1"], "")
+            text = texts[(href, key, idx)]
+            writer.writerow([href, key, idx, e["sha1"], raw, text])
+            if (href, key) not in incomplete:
+                values.setdefault(href, {}).setdefault(key, []).append(text)
+
+    stored = {}
+    streams = find_detail_streams()
+    for path in streams:
+        for obj in read_ndjson(path):
+            if obj.get("href") and not obj.get("ref"):
+                stored[obj["href"]] = obj
+
+    stats = {}
+    for (href, key, idx), e in latest.items():
+        s = stats.setdefault(
+            key, {"images": 0, "recognized": 0, "compared": 0, "agree": 0, "ms": 0.0}
+        )
+        s["images"] += 1
+        s["recognized"] += 1 if texts[(href, key, idx)] else 0
+        s["ms"] += ms_by_digest[e["sha1"]]
+
+    changes = {}
+    for href, fields in values.items():
+        record = stored.get(href, {})
+        for key, parts in fields.items():
+            value = "".join(parts)
+            if key in record:
+                stats[key]["compared"] += 1
+                stats[key]["agree"] += 1 if record.get(key) == value else 0
+            if record.get(key) != value:
+                changes.setdefault(href, {})[key] = value
+
+    report = {}
+    for key, s in sorted(stats.items()):
+        report[key] = {
+            "images": s["images"],
+            "recognized_rate": round(s["recognized"] / s["images"], 4),
+            "agreement": round(s["agree"] / s["compared"], 4) if s["compared"] else None,
+            "avg_ms": round(s["ms"] / s["images"], 2),
+        }
+        print(
+            f"{key}: 图片 {s['images']}，识别率 {report[key]['recognized_rate']:.2%}，"
+            f"与已存值一致 {s['agree']}/{s['compared']}，平均 {report[key]['avg_ms']}ms"
+        )
+    with open(os.path.join(args.out, "ocr_stats.json"), "w", encoding="utf-8") as f:
+        json.dump(
+            {
+                "images": len(digests),
+                "seconds": round(elapsed, 2),
+                "fields": report,
+            },
+            f,
+            ensure_ascii=False,
+            indent=2,
+        )
+    print(f"完成：{len(digests)} 张唯一图片，耗时 {elapsed:.1f}s")
+
+    if args.patch:
+        patched = 0
+        if changes:
+            for path in streams:
+                patched += patch_stream(path, changes)
+        # 更新 genpic 索引中的原始识别结果，后续抓取复用新引擎的结果
+        for e in entries:
+            if raw_by_digest.get(e.get("sha1")):
+                e["raw"] = raw_by_digest[e["sha1"]]
+        write_ndjson(GENPIC_INDEX_PATH, entries)
+        print(f"已回写详情流记录: {patched}")
+
+
+if __name__ == "__main__":
+    main()
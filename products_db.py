@@ -0,0 +1,293 @@
+"""将各品牌详情流合并为一个带索引的 SQLite 数据库，并提供快速查询。
+
+用法：
+    python products_db.py build                                   # 增量导入新的详情流行
+    python products_db.py query --max tar=6 --max pack_price=30   # 焦油 ≤ 6 且小盒 ≤ ¥30
+    python products_db.py query --text 细支 --order heat --desc --limit 20
+"""
+import argparse
+import csv
+import glob
+import json
+import os
+import re
+import sqlite3
+import sys
+import time
+
+DB_PATH = os.getenv("YANYUE_PRODUCTS_DB", "yanyue_products.db")
+
+# 列名 -> SQLite 类型；数值列从 "¥12.5"、"8mg" 等文本中提取首个数字
+COLUMNS = {
+    "name": "TEXT",
+    "brand": "TEXT",
+    "type": "TEXT",
+    "heat": "INTEGER",
+    "kouwei": "REAL",
+    "waiguan": "REAL",
+    "xingjiabi": "REAL",
+    "zonghe": "REAL",
+    "tar": "REAL",
+    "nicotine": "REAL",
+    "co": "REAL",
+    "length": "REAL",
+    "filter_length": "REAL",
+    "circumference": "REAL",
+    "packaging": "TEXT",
+    "main_color": "TEXT",
+    "sub_color": "TEXT",
+    "per_pack_count": "INTEGER",
+    "packs_per_carton": "INTEGER",
+    "pack_price": "REAL",
+    "carton_price": "REAL",
+    "pack_barcode": "TEXT",
+    "detail_text": "TEXT",
+    "ref": "TEXT",
+    "scraped_at": "INTEGER",
+}
+NUMERIC_COLUMNS = {c for c, t in COLUMNS.items() if t in ("INTEGER", "REAL")}
+INDEXED_COLUMNS = ("pack_price", "tar", "nicotine", "heat", "brand", "brand_key")
+OUTPUT_COLUMNS = (
+    "name",
+    "brand",
+    "brand_key",
+    "tar",
+    "nicotine",
+    "co",
+    "pack_price",
+    "carton_price",
+    "heat",
+    "href",
+)
+
+
+def find_detail_streams() -> list:
+    return sorted(
+        glob.glob(os.path.join("yanyue_*_output", "*", "*_details_stream.ndjson"))
+    )
+
+
+def connect(path: str = DB_PATH):
+    conn = sqlite3.connect(path)
+    conn.row_factory = sqlite3.Row
+    cols = ",\n    ".join(f"{c} {t}" for c, t in COLUMNS.items())
+    conn.executescript(
+        f"""
+CREATE TABLE IF NOT EXISTS products (
+    href TEXT NOT NULL,
+    brand_key TEXT NOT NULL,
+    section TEXT,
+    product_id INTEGER,
+    {cols},
+    PRIMARY KEY (href, brand_key)
+);
+CREATE TABLE IF NOT EXISTS sources (
+    path TEXT PRIMARY KEY,
+    inode INTEGER NOT NULL,
+    byte_offset INTEGER NOT NULL
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5(
+    name, detail_text, content='products', content_rowid='rowid', tokenize='trigram'
+);
+CREATE TRIGGER IF NOT EXISTS products_ai AFTER INSERT ON products BEGIN
+    INSERT INTO products_fts(rowid, name, detail_text)
+    VALUES (new.rowid, new.name, new.detail_text);
+END;
+CREATE TRIGGER IF NOT EXISTS products_ad AFTER DELETE ON products BEGIN
+    INSERT INTO products_fts(products_fts, rowid, name, detail_text)
+    VALUES ('delete', old.rowid, old.name, old.detail_text);
+END;
+CREATE TRIGGER IF NOT EXISTS products_au AFTER UPDATE ON products BEGIN
+    INSERT INTO products_fts(products_fts, rowid, name, detail_text)
+    VALUES ('delete', old.rowid, old.name, old.detail_text);
+    INSERT INTO products_fts(rowid, name, detail_text)
+    VALUES (new.rowid, new.name, new.detail_text);
+END;
+"""
+    )
+    for c in INDEXED_COLUMNS:
+        conn.execute(f"CREATE INDEX IF NOT EXISTS idx_products_{c} ON products({c})")
+    return conn
+
+
+def parse_number(value):
+    m = re.search(r"-?\d+(?:\.\d+)?", str(value or ""))
+    return float(m.group(0)) if m else None
+
+
+def to_row(obj: dict, brand_key: str, section: str) -> dict:
+    row = {"href": obj.get("href", ""), "brand_key": brand_key, "section": section}
+    m = re.search(r"/product/(\d+)", row["href"])
+    row["product_id"] = int(m.group(1)) if m else None
+    for c, t in COLUMNS.items():
+        value = obj.get(c, "")
+        if c in NUMERIC_COLUMNS:
+            value = parse_number(value)
+            if value is not None and t == "INTEGER":
+                value = int(value)
+        row[c] = value
+    return row
+
+
+def build(conn) -> int:
+    # 按文件记录已导入的字节偏移，只读取新追加的行；
+    # 文件被整体替换（如 ocr_test.py --patch 回写）或变短时从头导入
+    names = ["href", "brand_key", "section", "product_id", *COLUMNS]
+    updates = ", ".join(f"{c} = excluded.{c}" for c in names[2:])
+    sql = (
+        f"INSERT INTO products ({', '.join(names)}) "
+        f"VALUES ({', '.join('?' for _ in names)}) "
+        f"ON CONFLICT(href, brand_key) DO UPDATE SET {updates}"
+    )
+    imported = 0
+    for path in find_detail_streams():
+        st = os.stat(path)
+        src = conn.execute(
+            "SELECT inode, byte_offset FROM sources WHERE path = ?", (path,)
+        ).fetchone()
+        offset = 0
+        if src and src["inode"] == st.st_ino and src["byte_offset"] <= st.st_size:
+            offset = src["byte_offset"]
+        if offset >= st.st_size:
+            continue
+        brand_key = os.path.basename(os.path.dirname(path))
+        section = os.path.basename(os.path.dirname(os.path.dirname(path)))
+        section = section.removeprefix("yanyue_").removesuffix("_output")
+        rows = []
+        with open(path, "rb") as f:
+            f.seek(offset)
+            for line in f:
+                # 末尾未写完的行留到下次导入
+                if not line.endswith(b"\n"):
+                    break
+                offset += len(line)
+                try:
+                    obj = json.loads(line.decode("utf-8"))
+                except Exception:
+                    continue
+                if obj.get("href"):
+                    row = to_row(obj, brand_key, section)
+                    rows.append([row[c] for c in names])
+        with conn:
+            conn.executemany(sql, rows)
+            conn.execute(
+                "INSERT OR REPLACE INTO sources (path, inode, byte_offset) "
+                "VALUES (?, ?, ?)",
+                (path, st.st_ino, offset),
+            )
+        imported += len(rows)
+    return imported
+
+
+def parse_bounds(items: list) -> list:
+    bounds = []
+    for item in items or []:
+        field, sep, value = item.partition("=")
+        field = field.strip()
+        if field not in NUMERIC_COLUMNS:
+            choices = ", ".join(sorted(NUMERIC_COLUMNS))
+            raise SystemExit(f"不支持的数值字段: {field}（可选: {choices}）")
+        try:
+            number = float(value) if sep else None
+        except ValueError:
+            number = None
+        if number is None:
+            raise SystemExit(f"数值条件格式应为 FIELD=VALUE（如 tar=6）: {item}")
+        bounds.append((field, number))
+    return bounds
+
+
+def query(conn, args) -> list:
+    where = []
+    params = []
+    for field, value in parse_bounds(args.min):
+        where.append(f"p.{field} >= ?")
+        params.append(value)
+    for field, value in parse_bounds(args.max):
+        where.append(f"p.{field} <= ?")
+        params.append(value)
+    if args.brand:
+        where.append("(p.brand = ? OR p.brand_key = ?)")
+        params.extend([args.brand, args.brand])
+    else:
+        # 跨品牌引用的副本只在按品牌查询时返回
+        where.append("COALESCE(p.ref, '') = ''")
+    if args.section:
+        where.append("p.section = ?")
+        params.append(args.section)
+    if args.text and len(args.text) >= 3:
+        where.append(
+            "p.rowid IN (SELECT rowid FROM products_fts WHERE products_fts MATCH ?)"
+        )
+        # 整体作为 FTS5 短语匹配，避免 - " 等字符被当作查询语法
+        params.append('"' + args.text.replace('"', '""') + '"')
+    elif args.text:
+        # trigram 分词至少需要 3 个字符，更短的中文词退回 LIKE 扫描
+        where.append("(p.name LIKE ? OR p.detail_text LIKE ?)")
+        params.extend([f"%{args.text}%"] * 2)
+    sql = "SELECT p.* FROM products p"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    if args.order:
+        if args.order not in COLUMNS and args.order != "product_id":
+            raise SystemExit(f"不支持的排序字段: {args.order}")
+        sql += f" ORDER BY p.{args.order} {'DESC' if args.desc else 'ASC'}"
+    sql += " LIMIT ?"
+    params.append(args.limit)
+    return conn.execute(sql, params).fetchall()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="烟悦产品数据库")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("build", help="增量导入各品牌详情流")
+    q = sub.add_parser("query", help="按条件查询产品")
+    q.add_argument("--min", action="append", metavar="FIELD=VALUE", help="数值下限")
+    q.add_argument("--max", action="append", metavar="FIELD=VALUE", help="数值上限")
+    q.add_argument("--brand", help="品牌名或品牌目录（如 sort_14）")
+    q.add_argument("--section", help="分区：tobacco / hnb / e / unassigned")
+    q.add_argument("--text", help="名称与详情文本全文检索（按短语匹配）")
+    q.add_argument("--order", help="排序字段，如 heat、pack_price")
+    q.add_argument("--desc", action="store_true", help="降序")
+    q.add_argument("--limit", type=int, default=50)
+    q.add_argument("--format", choices=("table", "csv", "json"), default="table")
+    q.add_argument("--no-build", action="store_true", help="查询前不做增量导入")
+    args = parser.parse_args()
+
+    conn = connect()
+    if args.command == "build" or not args.no_build:
+        started = time.perf_counter()
+        imported = build(conn)
+        if args.command == "build" or imported:
+            total = conn.execute("SELECT COUNT(*) FROM products").fetchone()[0]
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            print(
+                f"导入 {imported} 行，共 {total} 条，耗时 {elapsed_ms:.0f}ms",
+                file=sys.stderr,
+            )
+    if args.command != "query":
+        return
+
+    started = time.perf_counter()
+    try:
+        rows = query(conn, args)
+    except sqlite3.OperationalError as e:
+        raise SystemExit(f"查询失败: {e}（请检查 --text / --order 等参数）")
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    if args.format == "json":
+        print(json.dumps([dict(r) for r in rows], ensure_ascii=False, indent=2))
+    elif args.format == "csv":
+        writer = csv.writer(sys.stdout)
+        writer.writerow(OUTPUT_COLUMNS)
+        for r in rows:
+            writer.writerow([r[c] for c in OUTPUT_COLUMNS])
+    else:
+        for r in rows:
+            print(
+                "\t".join("" if r[c] is None else str(r[c]) for c in OUTPUT_COLUMNS)
+            )
+    print(f"{len(rows)} 条结果，查询耗时 {elapsed_ms:.1f}ms", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()